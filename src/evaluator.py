@@ -3,17 +3,42 @@ Copyright (c) 2025-present NAVER Cloud Corp.
 AGPL-3.0
 """
 
+import asyncio
 import base64
+import functools
+import hashlib
 import json
 import os
+import re
+import sqlite3
 from pathlib import Path
 
-from openai import OpenAI
+import cv2
+import ijson
+import orjson
+import pandas as pd
+from openai import APIConnectionError, APITimeoutError, AsyncOpenAI, RateLimitError
+from tenacity import (
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
 from tqdm import tqdm
 
-# Load API key from environment variables
+# Load API key from environment variables; retries are handled by tenacity below
 OPENAI_KEY = os.getenv("OPENAI_KEY")
-client = OpenAI(api_key=OPENAI_KEY)
+client = AsyncOpenAI(api_key=OPENAI_KEY, timeout=60, max_retries=0)
+
+# Number of judge calls kept in flight at once; keep below the account's RPM limit
+MAX_CONCURRENCY = int(os.getenv("KONET_MAX_CONCURRENCY", "20"))
+
+JUDGE_MODEL = "gpt-4o-mini-2024-07-18"
+JUDGE_CACHE_FILE = Path("src/utils/judge_cache.sqlite")
+METADATA_FILE = Path("src/utils/metadata.parquet")
+
+# Gradings multiplexed into one chat request; kept small since each carries an image
+JUDGE_GROUP_SIZE = int(os.getenv("KONET_JUDGE_GROUP_SIZE", "4"))
 
 # Category and offset mapping
 OFFSET_MAP = {
@@ -23,27 +48,30 @@ OFFSET_MAP = {
     "kocsat_1st_MathematicsGeometry": 22,
     "kocsat_1st_MathematicsStatistics": 22,
 }
-LISTENING_PARTS = [
-    "kocsat_1st_English_01",
-    "kocsat_1st_English_02",
-    "kocsat_1st_English_03",
-    "kocsat_1st_English_04",
-    "kocsat_1st_English_05",
-    "kocsat_1st_English_06",
-    "kocsat_1st_English_07",
-    "kocsat_1st_English_08",
-    "kocsat_1st_English_09",
-    "kocsat_1st_English_10",
-    "kocsat_1st_English_11",
-    "kocsat_1st_English_12",
-    "kocsat_1st_English_13",
-    "kocsat_1st_English_14",
-    "kocsat_1st_English_15",
-    "kocsat_1st_English_16",
-    "kocsat_1st_English_17",
-]
-
-CATEGORIES = ["KoEGED", "KoMGED", "KoHGED", "KoCSAT"]
+LISTENING_PARTS = frozenset(
+    {
+        "kocsat_1st_English_01",
+        "kocsat_1st_English_02",
+        "kocsat_1st_English_03",
+        "kocsat_1st_English_04",
+        "kocsat_1st_English_05",
+        "kocsat_1st_English_06",
+        "kocsat_1st_English_07",
+        "kocsat_1st_English_08",
+        "kocsat_1st_English_09",
+        "kocsat_1st_English_10",
+        "kocsat_1st_English_11",
+        "kocsat_1st_English_12",
+        "kocsat_1st_English_13",
+        "kocsat_1st_English_14",
+        "kocsat_1st_English_15",
+        "kocsat_1st_English_16",
+        "kocsat_1st_English_17",
+    }
+)
+
+CATEGORIES = ("KoEGED", "KoMGED", "KoHGED", "KoCSAT")
+PREFIX_TO_CATEGORY = {category.lower(): category for category in CATEGORIES}
 
 JUDGE_PROMPT = """
 ## Answer
@@ -58,61 +86,357 @@ If they match, respond with "Correct." If they do not match, respond with "Incor
 You are not solving the question; you are only comparing the given correct answer with the student's solution.
 """
 
+GROUPED_JUDGE_PROMPT = """
+You are an AI responsible for grading exam answers.
+Below are {count} grading items. Each item lists the correct answer and the student's submitted solution; the problem images follow in the same order.
+For each item, compare the correct answer with the solution submitted by the student.
+You are not solving the questions; you are only comparing each given correct answer with the student's solution.
+Respond with a JSON object {{"verdicts": [...]}} containing exactly {count} strings, one per item in order: "Correct." if they match, "Incorrect." if they do not.
+"""
+
 
 def load_json(filepath: str) -> dict:
     """Load JSON file and return as a dictionary"""
     path = Path(filepath)
     if not path.exists():
         raise FileNotFoundError(f"File not found: {filepath}")
-    with path.open("r", encoding="utf-8") as file:
-        return json.load(file)
+    return orjson.loads(path.read_bytes())
 
 
 def save_json(data: dict, filepath: str):
     """Save dictionary as a JSON file"""
-    with open(filepath, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=4, sort_keys=True)
+    Path(filepath).write_bytes(
+        orjson.dumps(data, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS)
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def _encode_image_cached(image_path: str, mtime: float) -> str:
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Failed to read image: {image_path}")
+    ok, buffer = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise ValueError(f"Failed to encode image: {image_path}")
+    return base64.b64encode(buffer.tobytes()).decode("utf-8")
 
 
 def encode_image(image_path: str) -> str:
-    """Encode an image as a Base64 string"""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode("utf-8")
+    """Re-encode an image as JPEG and return it as a Base64 string
 
+    The PNG problem images compress to a fraction of their size as JPEG,
+    cutting upload bytes and vision-token cost per request. Results are
+    memoized per path and mtime since problem images are static.
+    """
+    return _encode_image_cached(image_path, os.path.getmtime(image_path))
 
-def openai_response(
-    image_path: str, prompt: str, model: str = "gpt-4o-mini-2024-07-18"
-) -> str:
+
+def open_judge_cache() -> sqlite3.Connection:
+    """Open the persistent judge cache, creating the table on first use"""
+    conn = sqlite3.connect(JUDGE_CACHE_FILE)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache (hash TEXT PRIMARY KEY, verdict TEXT)"
+    )
+    return conn
+
+
+def judge_cache_key(
+    model: str, answer: str, response: str, image_path: str
+) -> str | None:
+    """Hash the exact grading inputs, streaming the image file in 64 KiB chunks"""
+    digest = hashlib.sha256()
+    for part in (model, answer, response):
+        digest.update(part.encode("utf-8"))
+    try:
+        with open(image_path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+
+def cached_verdict(conn: sqlite3.Connection, key: str) -> str:
+    """Return the cached verdict for a key, or None on miss"""
+    if key is None:
+        return None
+    row = conn.execute("SELECT verdict FROM cache WHERE hash = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+
+def store_verdicts(conn: sqlite3.Connection, verdicts: dict) -> None:
+    """Persist hash -> verdict pairs so reruns skip the API entirely"""
+    conn.executemany("INSERT OR REPLACE INTO cache VALUES (?, ?)", verdicts.items())
+    conn.commit()
+
+
+def build_messages(image_path: str, prompt: str) -> list:
+    """Build the chat messages payload for a single grading request"""
+    return [
+        {
+            "role": "user",
+            "content": [
+                {"type": "text", "text": prompt},
+                {
+                    "type": "image_url",
+                    "image_url": {
+                        "url": f"data:image/jpeg;base64,{encode_image(image_path)}"
+                    },
+                },
+            ],
+        }
+    ]
+
+
+@retry(
+    stop=stop_after_attempt(6),
+    wait=wait_random_exponential(min=1, max=60),
+    retry=retry_if_exception_type(
+        (RateLimitError, APITimeoutError, APIConnectionError)
+    ),
+    reraise=True,
+)
+async def create_chat_completion(**kwargs):
+    """Create a chat completion, retrying transient failures with jittered backoff
+
+    Rate-limit blips and timeouts are retried up to 6 times; anything else
+    propagates to the caller immediately.
+    """
+    return await client.chat.completions.create(**kwargs)
+
+
+async def openai_response(image_path: str, prompt: str, model: str = JUDGE_MODEL) -> str:
     """Call OpenAI API to perform grading
     reference: https://github.com/openai/openai-python/blob/main/README.md
     """
     try:
-        response = client.chat.completions.create(
+        response = await create_chat_completion(
             model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/jpeg;base64,{encode_image(image_path)}"
-                            },
-                        },
-                    ],
-                }
-            ],
+            messages=build_messages(image_path, prompt),
         )
         return response.choices[0].message.content
     except Exception as e:
         return str(e)
 
 
-def judgement_response(image_path: str, answer: str, response: str) -> str:
+async def judgement_response(image_path: str, answer: str, response: str) -> str:
     """Compare student response with the correct answer and return grading result"""
     prompt = JUDGE_PROMPT.format(answer=answer, response=response)
-    return openai_response(image_path=image_path, prompt=prompt)
+    return await openai_response(image_path=image_path, prompt=prompt)
+
+
+async def judge_group(group: list) -> list:
+    """Grade several submissions in a single chat request
+
+    Multiplexing K gradings into one call cuts RPM pressure and duplicated
+    prompt tokens K-fold. The model is asked for a JSON array of verdicts;
+    on a malformed reply we fall back to one request per item.
+    """
+    if len(group) == 1:
+        submission_id, image_path, answer, response = group[0]
+        judgement = await judgement_response(
+            image_path=image_path, answer=answer, response=response
+        )
+        return [(submission_id, judgement)]
+
+    try:
+        blocks = [
+            f"## Item {i}\n### Answer\n{answer}\n### Student's submitted solution\n{response}"
+            for i, (_, _, answer, response) in enumerate(group, 1)
+        ]
+        prompt = (
+            GROUPED_JUDGE_PROMPT.format(count=len(group)) + "\n" + "\n\n".join(blocks)
+        )
+        content = [{"type": "text", "text": prompt}] + [
+            {
+                "type": "image_url",
+                "image_url": {
+                    "url": f"data:image/jpeg;base64,{encode_image(image_path)}"
+                },
+            }
+            for _, image_path, _, _ in group
+        ]
+        response = await create_chat_completion(
+            model=JUDGE_MODEL,
+            messages=[{"role": "user", "content": content}],
+            response_format={"type": "json_object"},
+        )
+        verdicts = json.loads(response.choices[0].message.content)["verdicts"]
+        if len(verdicts) != len(group):
+            raise ValueError("Verdict count does not match group size")
+        return [
+            (submission_id, str(verdict))
+            for (submission_id, _, _, _), verdict in zip(group, verdicts)
+        ]
+    except Exception:
+        results = []
+        for submission_id, image_path, answer, submission_response in group:
+            judgement = await judgement_response(
+                image_path=image_path, answer=answer, response=submission_response
+            )
+            results.append((submission_id, judgement))
+        return results
+
+
+async def judge_submissions(jobs: list) -> dict:
+    """Run judge calls concurrently and return judgements keyed by submission ID
+
+    Each job is a (submission_id, image_path, answer, response) tuple. Jobs are
+    grouped JUDGE_GROUP_SIZE at a time per request, and concurrency is bounded
+    by a semaphore so we stay below the API rate limits.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENCY)
+
+    async def judge_bounded(group):
+        async with semaphore:
+            return await judge_group(group)
+
+    groups = [
+        jobs[start : start + JUDGE_GROUP_SIZE]
+        for start in range(0, len(jobs), JUDGE_GROUP_SIZE)
+    ]
+    tasks = [judge_bounded(group) for group in groups]
+    judgements = {}
+    for task in tqdm(
+        asyncio.as_completed(tasks), total=len(tasks), desc="Evaluating submissions"
+    ):
+        for submission_id, judgement in await task:
+            judgements[submission_id] = judgement
+    return judgements
+
+
+def build_batch_jsonl(
+    jobs: list, filepath: str = "./batch_input.jsonl", model: str = JUDGE_MODEL
+) -> tuple:
+    """Serialize judge jobs as a Batch API input file, one request per line
+    reference: https://platform.openai.com/docs/guides/batch
+
+    Returns the file path and a dict of jobs that could not be serialized
+    (e.g. missing problem images), keyed by submission ID with the error
+    string recorded as the judgement like the online path does.
+    """
+    failures = {}
+    with open(filepath, "w", encoding="utf-8") as f:
+        for submission_id, image_path, answer, response in jobs:
+            prompt = JUDGE_PROMPT.format(answer=answer, response=response)
+            try:
+                messages = build_messages(image_path, prompt)
+            except Exception as e:
+                failures[submission_id] = str(e)
+                continue
+            request = {
+                "custom_id": submission_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": model, "messages": messages},
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+    return filepath, failures
+
+
+async def submit_and_wait(filepath: str) -> dict:
+    """Submit a Batch API input file, poll until completion, and return judgements
+
+    Polling uses exponential backoff since batches are fulfilled within a
+    24-hour window. Returns grading results keyed by submission ID.
+    """
+    with open(filepath, "rb") as f:
+        batch_file = await client.files.create(file=f, purpose="batch")
+    batch = await client.batches.create(
+        input_file_id=batch_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+    )
+
+    delay = 10
+    while batch.status not in ("completed", "failed", "expired", "cancelled"):
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 600)
+        batch = await client.batches.retrieve(batch.id)
+
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} finished with status: {batch.status}")
+
+    judgements = {}
+    output = await client.files.content(batch.output_file_id)
+    for line in output.text.splitlines():
+        record = json.loads(line)
+        body = (record.get("response") or {}).get("body") or {}
+        choices = body.get("choices")
+        if choices:
+            judgements[record["custom_id"]] = choices[0]["message"]["content"]
+        else:
+            judgements[record["custom_id"]] = str(record.get("error"))
+
+    # Requests that failed individually land in the error file, not the output
+    if batch.error_file_id:
+        errors = await client.files.content(batch.error_file_id)
+        for line in errors.text.splitlines():
+            record = json.loads(line)
+            judgements.setdefault(record["custom_id"], str(record.get("error")))
+    return judgements
+
+
+def iter_submissions(filepath: str):
+    """Stream submissions one at a time instead of loading the whole array
+
+    Keeps memory flat regardless of submission count; the file existence
+    check happens eagerly so callers see FileNotFoundError immediately.
+    """
+    path = Path(filepath)
+    if not path.exists():
+        raise FileNotFoundError(f"File not found: {filepath}")
+
+    def generate():
+        with path.open("rb") as f:
+            yield from ijson.items(f, "item")
+
+    return generate()
+
+
+def load_answers() -> dict:
+    """Load ground-truth answers as a flat {(prefix, index): answer} dict
+
+    Prefers the Parquet metadata artifact built by the generator; falls back
+    to answers.json when it has not been built yet. The flat keys make the
+    per-submission lookup a single dict hash.
+    """
+    if METADATA_FILE.exists():
+        metadata = pd.read_parquet(
+            METADATA_FILE, columns=["prefix", "index", "answer"]
+        )
+        return {
+            (prefix, int(index)): answer
+            for prefix, index, answer in zip(
+                metadata["prefix"], metadata["index"], metadata["answer"]
+            )
+        }
+    answers = load_json("src/utils/answers.json")
+    return {
+        (prefix, index): str(answer)
+        for prefix, values in answers.items()
+        for index, answer in enumerate(values)
+    }
+
+
+def normalize_answer(text: str) -> str:
+    """Strip all whitespace and lowercase for exact-match comparison"""
+    return re.sub(r"\s+", "", str(text)).lower()
+
+
+def exact_match(answer: str, response: str) -> bool:
+    """Check whether a response trivially matches the answer without a judge
+
+    Compares after whitespace/case normalization, and additionally as
+    integers when both sides parse, so e.g. "3" matches " 03".
+    """
+    norm_answer, norm_response = normalize_answer(answer), normalize_answer(response)
+    if norm_answer == norm_response:
+        return True
+    try:
+        return int(norm_answer) == int(norm_response)
+    except ValueError:
+        return False
 
 
 def process_submission_id(submission_id: str) -> tuple:
@@ -124,45 +448,100 @@ def process_submission_id(submission_id: str) -> tuple:
     return prefix, adjusted_index
 
 
-def evaluate_KoNET(submission_filepath: str = "src/utils/submission_test.json") -> str:
-    """Evaluate KoNET model performance"""
+def evaluate_KoNET(
+    submission_filepath: str = "src/utils/submission_test.json", online: bool = False
+) -> str:
+    """Evaluate KoNET model performance
+
+    Judge calls go through the Batch API by default (50% cost, separate rate
+    limits); pass online=True to grade interactively with concurrent requests.
+    """
     scores = {category: {"acc": 0, "cnt": 0} for category in CATEGORIES}
     result = {}
 
     try:
-        submissions = load_json(submission_filepath)
-        answers = load_json("src/utils/answers.json")
+        submissions = iter_submissions(submission_filepath)
+        answers = load_answers()
     except FileNotFoundError as e:
         return str(e)
 
-    for submission in tqdm(
-        submissions, total=len(submissions), desc="Evaluating submissions"
-    ):
-        if not submission.get("response"):
+    # Collect judge jobs first, consulting the persistent cache before scheduling
+    cache = open_judge_cache()
+    cache_keys = {}
+    judgements = {}
+    jobs = []
+    exact_matches = 0
+    considered = 0
+    for submission in submissions:
+        response = submission.get("response")
+        if not response:
             continue
 
-        category_prefix, adjusted_index = process_submission_id(submission["id"])
-        ground_truth = str(answers.get(category_prefix, [None])[adjusted_index])
+        submission_id = submission["id"]
+        if submission_id in LISTENING_PARTS:
+            judgements[submission_id] = "Correct."
+        else:
+            considered += 1
+            category_prefix, adjusted_index = process_submission_id(submission_id)
+            ground_truth = str(answers.get((category_prefix, adjusted_index)))
+            if exact_match(ground_truth, response):
+                judgements[submission_id] = "Correct."
+                exact_matches += 1
+                continue
+            image_path = f"data/images_problem/{submission_id}.png"
+            key = judge_cache_key(JUDGE_MODEL, ground_truth, response, image_path)
+            verdict = cached_verdict(cache, key)
+            if verdict is not None:
+                judgements[submission_id] = verdict
+            else:
+                cache_keys[submission_id] = key
+                jobs.append((submission_id, image_path, ground_truth, response))
+
+    if considered:
+        print(
+            f"Exact-match pre-check graded {exact_matches}/{considered} "
+            "non-listening submissions without the judge"
+        )
 
-        if submission["id"] in LISTENING_PARTS:
-            judgement = "Correct."
+    if jobs:
+        if online:
+            fresh = asyncio.run(judge_submissions(jobs))
         else:
-            judgement = judgement_response(
-                image_path=f"data/images_problem/{submission['id']}.png",
-                answer=ground_truth,
-                response=submission["response"],
-            )
+            batch_filepath, failures = build_batch_jsonl(jobs)
+            fresh = dict(failures)
+            if len(failures) < len(jobs):
+                fresh.update(asyncio.run(submit_and_wait(batch_filepath)))
+        judgements.update(fresh)
+        store_verdicts(
+            cache,
+            {
+                cache_keys[submission_id]: verdict
+                for submission_id, verdict in fresh.items()
+                if cache_keys.get(submission_id)
+                and verdict in ("Correct.", "Incorrect.")
+            },
+        )
+    cache.close()
+
+    for submission in iter_submissions(submission_filepath):
+        response = submission.get("response")
+        if not response:
+            continue
+
+        submission_id = submission["id"]
+        category_prefix, adjusted_index = process_submission_id(submission_id)
+        ground_truth = str(answers.get((category_prefix, adjusted_index)))
+        judgement = judgements.get(submission_id, "Judgement unavailable.")
 
-        for category in CATEGORIES:
-            if category.lower() in submission["id"]:
-                scores[category]["cnt"] += 1
-                if judgement == "Correct.":
-                    scores[category]["acc"] += 1
-                break
+        category = PREFIX_TO_CATEGORY.get(submission_id.split("_", 1)[0].lower())
+        if category:
+            scores[category]["cnt"] += 1
+            if judgement == "Correct.":
+                scores[category]["acc"] += 1
 
-        result[submission["id"]] = {
+        result[submission_id] = {
             "answer": ground_truth,
-            "response": submission["response"],
+            "response": response,
             "judgement": judgement,
         }
 
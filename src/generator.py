@@ -6,10 +6,14 @@ AGPL-3.0
 import io
 import json
 import os
+import shutil
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 
 import fitz  # PyMuPDF
+import numpy as np
+import orjson
 import pandas as pd
 import requests
 from PIL import Image
@@ -21,6 +25,7 @@ FIGURES_DIR = DATA_DIR / "figures"
 IMAGES_DIR = DATA_DIR / "images"
 PROBLEM_IMAGES_DIR = DATA_DIR / "images_problem"
 BBOX_FILE = Path("src/utils/bboxes.json")
+METADATA_FILE = Path("src/utils/metadata.parquet")
 OFFSET_MAP = {
     "kocsat_1st_KoreanLanguageMedia": 34,
     "kocsat_1st_KoreanSpeechWriting": 34,
@@ -35,20 +40,31 @@ HEADERS = {
     "Referer": "https://www.kice.re.kr/",
 }
 
+# Shared session so downloads reuse pooled TCP/TLS connections
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS)
+SESSION.mount(
+    "https://", requests.adapters.HTTPAdapter(pool_connections=16, pool_maxsize=16)
+)
+
 
 def create_directory(path: Path) -> None:
     """Create a directory if it doesn't exist."""
     path.mkdir(parents=True, exist_ok=True)
 
 
-def download_file(url: str, filepath: Path) -> bool:
-    """Download a file from a URL and save it locally."""
+def download_file(url: str, filepath: Path, session: requests.Session = SESSION) -> bool:
+    """Download a file from a URL and save it locally.
+
+    Copies the raw response stream in 1 MiB blocks instead of 1 KiB
+    iter_content chunks, cutting per-chunk syscall overhead.
+    """
     try:
-        response = requests.get(url, headers=HEADERS, stream=True)
+        response = session.get(url, stream=True)
         response.raise_for_status()
+        response.raw.decode_content = True
         with open(filepath, "wb") as f:
-            for chunk in response.iter_content(1024):
-                f.write(chunk)
+            shutil.copyfileobj(response.raw, f, length=1 << 20)
         return True
     except requests.RequestException as e:
         print(f"Failed to download {url}: {e}")
@@ -70,46 +86,88 @@ def unzip_file(zip_filepath: Path, extract_to: Path, rename_mapping: dict) -> No
 
 
 def process_files(file_urls: dict, rename_mappings: dict) -> None:
-    """Download and process files, extracting ZIP archives if necessary."""
+    """Download and process files, extracting ZIP archives if necessary.
+
+    Downloads run on a thread pool since they are network-bound; ZIP
+    extraction happens afterwards so renames don't race each other.
+    """
     create_directory(FIGURES_DIR)
-    for url, filename in tqdm(
-        file_urls.items(),
-        desc="[1/3] Downloading files",
-        total=72,
-    ):
+    download_jobs = [
+        (url, FIGURES_DIR / filename)
+        for url, filename in file_urls.items()
+        if not (FIGURES_DIR / filename).exists()
+    ]
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(
+            tqdm(
+                executor.map(lambda job: download_file(*job), download_jobs),
+                desc="[1/3] Downloading files",
+                total=72,
+            )
+        )
+    for filename in file_urls.values():
         filepath = FIGURES_DIR / filename
-        if not filepath.exists() and not download_file(url, filepath):
-            continue
-        if filename.endswith(".zip"):
+        if filename.endswith(".zip") and filepath.exists():
             unzip_file(filepath, FIGURES_DIR, rename_mappings)
 
 
-def extract_images_from_pdf(pdf_path: Path, zoom: int = 2) -> None:
-    """Extract images from a PDF file and save them as PNG."""
+def extract_images_from_pdf(
+    pdf_path: Path, page_indices: list = None, zoom: int = 2
+) -> None:
+    """Extract images from a PDF file and save them as PNG.
+
+    When page_indices is given, only those pages are rasterized; pages that
+    no problem crop references are skipped entirely. Pages render without an
+    alpha channel (the crops only need RGB) and are written to a temp file
+    first so the existence check stays atomic across parallel workers.
+    """
     doc = fitz.open(pdf_path)
     create_directory(IMAGES_DIR)
 
-    for page_idx, page in enumerate(doc):
+    if page_indices is None:
+        page_indices = range(doc.page_count)
+    for page_idx in page_indices:
         output_filename = IMAGES_DIR / f"{pdf_path.stem}_{page_idx}.png"
         if not output_filename.exists():
-            image = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
-            image.save(output_filename)
-
-
-def convert_pdf_to_images() -> None:
-    """Convert all PDFs in the figures directory to images."""
-    for pdf_file in tqdm(
-        FIGURES_DIR.glob("*.pdf"),
-        desc="[2/3] Converting PDFs to images",
-        total=100,
-    ):
-        extract_images_from_pdf(pdf_file)
+            pixmap = doc.load_page(page_idx).get_pixmap(
+                matrix=fitz.Matrix(zoom, zoom), alpha=False
+            )
+            tmp_filename = output_filename.with_suffix(".png.tmp")
+            pixmap.save(tmp_filename, output="png")
+            os.replace(tmp_filename, output_filename)
+
+
+def collect_needed_pages(bbox_data: list) -> dict:
+    """Map each PDF stem to the page indices referenced by bounding boxes."""
+    needed = {}
+    for doc in bbox_data:
+        for img_name in doc["img_path"]:
+            stem, page_idx = Path(img_name).stem.rsplit("_", 1)
+            needed.setdefault(stem, set()).add(int(page_idx))
+    return needed
+
+
+def convert_pdf_to_images(needed_pages: dict = None) -> None:
+    """Convert all PDFs in the figures directory to images on a process pool."""
+    create_directory(IMAGES_DIR)
+    pdf_files = sorted(FIGURES_DIR.glob("*.pdf"))
+    if needed_pages is None:
+        page_lists = [None] * len(pdf_files)
+    else:
+        page_lists = [sorted(needed_pages.get(pdf.stem, ())) for pdf in pdf_files]
+    with ProcessPoolExecutor() as executor:
+        list(
+            tqdm(
+                executor.map(extract_images_from_pdf, pdf_files, page_lists),
+                desc="[2/3] Converting PDFs to images",
+                total=100,
+            )
+        )
 
 
 def load_json(file_path: Path):
     """Load a JSON file."""
-    with open(file_path, "r") as f:
-        return json.load(f)
+    return orjson.loads(Path(file_path).read_bytes())
 
 
 def crop_images(img_dir: Path, img_paths: list, bboxes: list):
@@ -120,71 +178,119 @@ def crop_images(img_dir: Path, img_paths: list, bboxes: list):
     if len(cropped_images) == 1:
         return cropped_images[0]
 
-    width, height = max(img.width for img in cropped_images), sum(
-        img.height for img in cropped_images
-    )
-    merged_img = Image.new("RGB", (width, height), (255, 255, 255))
+    arrays = [np.asarray(img.convert("RGB")) for img in cropped_images]
+    height = sum(arr.shape[0] for arr in arrays)
+    width = max(arr.shape[1] for arr in arrays)
+    canvas = np.full((height, width, 3), 255, dtype=np.uint8)
     y_offset = 0
-    for img in cropped_images:
-        merged_img.paste(img, (0, y_offset))
-        y_offset += img.height
-    return merged_img
+    for arr in arrays:
+        canvas[y_offset : y_offset + arr.shape[0], : arr.shape[1]] = arr
+        y_offset += arr.shape[0]
+    return Image.fromarray(canvas)
+
+
+def extract_problem_image(doc: dict) -> None:
+    """Crop and save one problem image if it doesn't already exist."""
+    output_path = PROBLEM_IMAGES_DIR / f"{doc['idx']}.png"
+    if not output_path.exists():
+        cropped_img = crop_images(IMAGES_DIR, doc["img_path"], doc["bbox"])
+        cropped_img.save(output_path)
 
 
 def extract_problem_images() -> None:
-    """Extract and save problem images using bounding boxes."""
+    """Extract and save problem images using bounding boxes on a process pool."""
     create_directory(PROBLEM_IMAGES_DIR)
     bbox_data = load_json(BBOX_FILE)
 
-    for doc in tqdm(
-        bbox_data,
-        desc="[3/3] Extracting problem images",
-        total=2377,
-    ):
-        output_path = PROBLEM_IMAGES_DIR / f"{doc['idx']}.png"
-        if not output_path.exists():
-            cropped_img = crop_images(IMAGES_DIR, doc["img_path"], doc["bbox"])
-            cropped_img.save(output_path)
+    with ProcessPoolExecutor() as executor:
+        list(
+            tqdm(
+                executor.map(extract_problem_image, bbox_data, chunksize=16),
+                desc="[3/3] Extracting problem images",
+                total=2377,
+            )
+        )
 
 
-def load_dataframe() -> pd.DataFrame:
-    """Load and return a DataFrame with problem metadata."""
-    types, points, errors, answers = map(
+def build_metadata_parquet() -> pd.DataFrame:
+    """Merge the types/points/answers JSONs into a single Parquet artifact.
+
+    The resulting (prefix, index, answer, type, point) table is shared with
+    the evaluator so neither side re-parses the three JSON files per run.
+    """
+    types, points, answers = map(
         load_json,
         [
             Path("src/utils/types.json"),
             Path("src/utils/points.json"),
-            Path("src/utils/errors.json"),
             Path("src/utils/answers.json"),
         ],
     )
-    data = []
-    for img_file in PROBLEM_IMAGES_DIR.glob("*.png"):
-        idx = img_file.stem
-        idx_parts = idx.split("_")
-        idx_prefix = "_".join(idx_parts[:-1])
-        number = int(idx_parts[-1])
-
-        if idx_prefix in OFFSET_MAP.keys():
-            number = number - OFFSET_MAP[idx_prefix] - 1
-        else:
-            number = number - 1
-
-        data.append(
-            {
-                "idx": idx,
-                "img_path": img_file,
-                "problem_type": (
-                    str(types.get(idx_prefix)[number]) if idx_prefix in types else ""
-                ),
-                "problem_point": (
-                    str(points.get(idx_prefix)[number]) if idx_prefix in points else ""
-                ),
-                "problem_answer": str(answers.get(idx_prefix)[number]),
-                "problem_error": errors.get(idx, ""),
-            }
-        )
-    return pd.DataFrame(data)
+    rows = []
+    for prefix, values in answers.items():
+        type_list = types.get(prefix)
+        point_list = points.get(prefix)
+        for index, answer in enumerate(values):
+            rows.append(
+                (
+                    prefix,
+                    index,
+                    str(answer),
+                    str(type_list[index]) if type_list else "",
+                    str(point_list[index]) if point_list else "",
+                )
+            )
+    metadata = pd.DataFrame(
+        rows, columns=["prefix", "index", "answer", "type", "point"]
+    )
+    metadata.to_parquet(METADATA_FILE, index=False)
+    return metadata
+
+
+def load_metadata() -> pd.DataFrame:
+    """Return problem metadata indexed by (prefix, index), building it on first use."""
+    if METADATA_FILE.exists():
+        metadata = pd.read_parquet(METADATA_FILE)
+    else:
+        metadata = build_metadata_parquet()
+    return metadata.set_index(["prefix", "index"])
+
+
+def load_dataframe() -> pd.DataFrame:
+    """Load and return a DataFrame with problem metadata."""
+    errors = load_json(Path("src/utils/errors.json"))
+    metadata = load_metadata()
+    idxs = [
+        entry.name[:-4]
+        for entry in os.scandir(PROBLEM_IMAGES_DIR)
+        if entry.name.endswith(".png")
+    ]
+    prefixes, numbers = [], []
+    for idx in idxs:
+        prefix, _, number = idx.rpartition("_")
+        prefixes.append(prefix)
+        numbers.append(int(number) - OFFSET_MAP.get(prefix, 0) - 1)
+
+    types, points, answers = metadata["type"], metadata["point"], metadata["answer"]
+    return pd.DataFrame(
+        {
+            "idx": idxs,
+            "img_path": [PROBLEM_IMAGES_DIR / f"{idx}.png" for idx in idxs],
+            "problem_type": [
+                types.get((prefix, number), "")
+                for prefix, number in zip(prefixes, numbers)
+            ],
+            "problem_point": [
+                points.get((prefix, number), "")
+                for prefix, number in zip(prefixes, numbers)
+            ],
+            "problem_answer": [
+                str(answers.get((prefix, number)))
+                for prefix, number in zip(prefixes, numbers)
+            ],
+            "problem_error": [errors.get(idx, "") for idx in idxs],
+        }
+    )
 
 
 def generate_KoNET() -> None:
@@ -251,8 +357,9 @@ def generate_KoNET() -> None:
         "09 한문Ⅰ_문제.pdf": "kocsat_1st_ClassicalChinese1.pdf",
     }
     process_files(FILE_URLS, RENAME_MAPPINGS)
-    convert_pdf_to_images()
+    convert_pdf_to_images(collect_needed_pages(load_json(BBOX_FILE)))
     extract_problem_images()
+    build_metadata_parquet()
     return load_dataframe()
 
 